@@ -0,0 +1,37 @@
+# cython: boundscheck=False, wraparound=False, language_level=3
+"""
+Compiled feature extraction for ScheduleAnomalyDetector
+"""
+import numpy as np
+from cpython.dict cimport PyDict_GetItem
+from cpython.ref cimport PyObject
+
+cpdef extract_features_fast(list schedule_data, tuple schedule_features):
+    """
+    Fill an (n, n_features) float32 array from schedule entry dicts.
+    schedule_features is the (column, key, default) table from anomaly_detector.
+    """
+    cdef Py_ssize_t n = len(schedule_data)
+    cdef Py_ssize_t n_features = len(schedule_features)
+    cdef Py_ssize_t i, j
+    cdef dict entry
+    cdef PyObject* value
+    # Keep the key objects so lookups reuse their cached hashes
+    cdef list keys = [key for _, key, _ in schedule_features]
+    cdef float[::1] defaults = np.array(
+        [default for _, _, default in schedule_features], dtype=np.float32
+    )
+    
+    features = np.empty((n, n_features), dtype=np.float32)
+    cdef float[:, ::1] out = features
+    
+    for i in range(n):
+        entry = schedule_data[i]
+        for j in range(n_features):
+            value = PyDict_GetItem(entry, keys[j])
+            if value is NULL:
+                out[i, j] = defaults[j]
+            else:
+                out[i, j] = <float>(<object>value)
+    
+    return features
@@ -1,40 +1,172 @@
+import os
 import numpy as np
+from sklearn.base import clone
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import pandas as pd
+import joblib
+
+try:
+    # Compiled extractor, built with `python setup.py build_ext --inplace`
+    from ._anomaly_fast import extract_features_fast
+except ImportError:
+    extract_features_fast = None
+
+# (feature column, schedule entry key, default) in model input order
+SCHEDULE_FEATURES = (
+    ('calls_per_resident', 'calls_count', 0),
+    ('consecutive_calls', 'consecutive_calls', 0),
+    ('weekend_concentration', 'weekend_ratio', 0),
+    ('coverage_gaps', 'coverage_gaps', 0),
+    ('fairness_index', 'fairness_index', 1),
+    ('pgy_distribution', 'pgy_variance', 0),
+    ('vacation_conflicts', 'vacation_conflicts', 0),
+    ('workload_variance', 'workload_variance', 0),
+)
+FEATURE_COLUMNS = tuple(column for column, _, _ in SCHEDULE_FEATURES)
+
+# Record layout for producers that send schedule_data as a NumPy structured
+# array instead of a list of dicts: one packed float32 field per entry key,
+# in SCHEDULE_FEATURES order. Missing values must be filled with the defaults
+# above, and such records carry no residents/date_range details.
+SCHEDULE_DTYPE = np.dtype([(key, np.float32) for _, key, _ in SCHEDULE_FEATURES])
+
+# Column positions used by the rule-based classification
+CONSECUTIVE_CALLS = FEATURE_COLUMNS.index('consecutive_calls')
+COVERAGE_GAPS = FEATURE_COLUMNS.index('coverage_gaps')
+FAIRNESS_INDEX = FEATURE_COLUMNS.index('fairness_index')
+VACATION_CONFLICTS = FEATURE_COLUMNS.index('vacation_conflicts')
+
+# Lookup tables indexed by the codes from classify_anomalies / calculate_severities
+ANOMALY_TYPES = (
+    'Excessive Consecutive Calls',
+    'Coverage Gap Detected',
+    'Unfair Distribution',
+    'Vacation Conflict',
+    'General Anomaly',
+)
+RECOMMENDATIONS = (
+    'Redistribute calls to prevent burnout. Consider adding post-call days.',
+    'Fill coverage gaps by adjusting vacation approvals or adding backup residents.',
+    'Rebalance call distribution to ensure fairness across all residents.',
+    'Review and adjust vacation schedules to avoid conflicts.',
+    'Review schedule manually for optimization opportunities.',
+)
+SEVERITY_LEVELS = ('Critical', 'High', 'Medium', 'Low')
+# Upper edges on the decision_function scale (distance below the anomaly
+# threshold). Flagged rows of a contamination=0.1 forest score roughly
+# -0.12..0, so the edges split that range rather than the raw score_samples one
+SEVERITY_BINS = (-0.1, -0.05, -0.02)
 
 class ScheduleAnomalyDetector:
     """
     Detects scheduling anomalies and potential issues
     """
-    def __init__(self):
-        self.model = IsolationForest(
-            contamination=0.1,
-            random_state=42
-        )
-        self.scaler = StandardScaler()
+    def __init__(self, model_path='models/anomaly_detector.pkl',
+                 scaler_path='models/anomaly_scaler.npz'):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.model, model_fitted = self.load_model(model_path)
+        self.feature_mean, self.feature_iscale, scaling_fitted = self.load_scaling(scaler_path)
+        self.is_fitted = model_fitted and scaling_fitted
         
+    def load_model(self, path):
+        try:
+            return joblib.load(path), True
+        except:
+            # Initialize new model if not found
+            model = IsolationForest(
+                contamination=0.1,
+                random_state=42
+            )
+            return model, False
+    
+    def load_scaling(self, path):
+        try:
+            with np.load(path) as scaling:
+                return scaling['mean'], scaling['iscale'], True
+        except:
+            # Identity scaling until fit runs
+            n_features = len(SCHEDULE_FEATURES)
+            return np.zeros(n_features, np.float32), np.ones(n_features, np.float32), False
+    
+    def scale_features(self, X):
+        """
+        Standardize feature rows with the persisted float32 mean / inverse scale
+        """
+        return (X - self.feature_mean) * self.feature_iscale
+    
+    def fit_estimators(self, X):
+        """
+        Fit float32 scaling and a fresh copy of the forest on feature rows,
+        without touching the detector's own state
+        """
+        scaler = StandardScaler().fit(X)
+        feature_mean = scaler.mean_.astype(np.float32)
+        feature_iscale = (1 / scaler.scale_).astype(np.float32)
+        
+        model = clone(self.model)
+        model.fit((X - feature_mean) * feature_iscale)
+        
+        return model, feature_mean, feature_iscale
+    
+    def fit(self, training_data):
+        """
+        Train the detector offline and persist the fitted scaling and model
+        """
+        X = self.feature_matrix(training_data)
+        
+        self.model, self.feature_mean, self.feature_iscale = self.fit_estimators(X)
+        self.is_fitted = True
+        
+        # Save model and the scaling it was trained with
+        for path in (self.model_path, self.scaler_path):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump(self.model, self.model_path)
+        np.savez(self.scaler_path, mean=self.feature_mean, iscale=self.feature_iscale)
+        
+        return {
+            'status': 'trained',
+            'samples': len(X)
+        }
+    
     def detect_anomalies(self, schedule_data):
         """
         Detect anomalies in schedule
         """
-        features = self.extract_schedule_features(schedule_data)
-        scaled_features = self.scaler.fit_transform(features)
+        structured = self.is_structured(schedule_data)
+        values = self.feature_matrix(schedule_data)
+        
+        if self.is_fitted:
+            model = self.model
+            scaled_features = self.scale_features(values)
+        else:
+            # No trained artifacts: score this batch against a model fitted
+            # to it, in memory only - nothing is persisted from a request
+            model, feature_mean, feature_iscale = self.fit_estimators(values)
+            scaled_features = (values - feature_mean) * feature_iscale
         
-        # Predict anomalies (-1 for anomaly, 1 for normal)
-        predictions = self.model.fit_predict(scaled_features)
-        anomaly_scores = self.model.score_samples(scaled_features)
+        # Score only - the forest is never rebuilt on the request path.
+        # One traversal: the decision scores give both the prediction
+        # (negative for anomalies; -1 for anomaly, 1 for normal) and severity
+        anomaly_scores = model.decision_function(scaled_features)
+        predictions = np.where(anomaly_scores < 0, -1, 1)
+        
+        # Classify every row in one pass, then only visit the anomalous ones
+        type_codes = self.classify_anomalies(values)
+        severity_codes = self.calculate_severities(anomaly_scores)
         
         anomalies = []
-        for i, (pred, score) in enumerate(zip(predictions, anomaly_scores)):
-            if pred == -1:
-                anomalies.append({
-                    'index': i,
-                    'type': self.classify_anomaly(features.iloc[i]),
-                    'severity': self.calculate_severity(score),
-                    'details': self.get_anomaly_details(features.iloc[i], schedule_data[i]),
-                    'recommendation': self.get_recommendation(features.iloc[i])
-                })
+        for i in np.flatnonzero(predictions == -1):
+            code = type_codes[i]
+            original_data = {} if structured else schedule_data[i]
+            anomalies.append({
+                'index': int(i),
+                'type': ANOMALY_TYPES[code],
+                'severity': SEVERITY_LEVELS[severity_codes[i]],
+                'details': self.get_anomaly_details(values[i], original_data),
+                'recommendation': RECOMMENDATIONS[code]
+            })
         
         return {
             'total_anomalies': len(anomalies),
@@ -42,79 +174,84 @@ class ScheduleAnomalyDetector:
             'health_score': self.calculate_health_score(predictions)
         }
     
+    def is_structured(self, schedule_data):
+        return isinstance(schedule_data, np.ndarray) and schedule_data.dtype.names is not None
+    
+    def feature_matrix(self, schedule_data):
+        """
+        Feature rows as an (n, 8) float32 ndarray from either input form;
+        structured arrays are the zero-copy path
+        """
+        if self.is_structured(schedule_data):
+            return self.extract_schedule_features_from_struct(schedule_data)
+        return self.extract_schedule_features(schedule_data).values
+    
+    def extract_schedule_features_from_struct(self, schedule_data):
+        """
+        Extract features from a SCHEDULE_DTYPE structured array as a
+        zero-copy (n, 8) float32 view
+        """
+        if schedule_data.dtype != SCHEDULE_DTYPE:
+            raise ValueError(f'schedule_data must have dtype {SCHEDULE_DTYPE}, got {schedule_data.dtype}')
+        
+        n_features = len(SCHEDULE_FEATURES)
+        return schedule_data.view((np.float32, n_features)).reshape(-1, n_features)
+    
     def extract_schedule_features(self, schedule_data):
         """
         Extract features from schedule for anomaly detection
         """
-        features = []
-        
-        for entry in schedule_data:
-            features.append({
-                'calls_per_resident': entry.get('calls_count', 0),
-                'consecutive_calls': entry.get('consecutive_calls', 0),
-                'weekend_concentration': entry.get('weekend_ratio', 0),
-                'coverage_gaps': entry.get('coverage_gaps', 0),
-                'fairness_index': entry.get('fairness_index', 1),
-                'pgy_distribution': entry.get('pgy_variance', 0),
-                'vacation_conflicts': entry.get('vacation_conflicts', 0),
-                'workload_variance': entry.get('workload_variance', 0)
-            })
+        if extract_features_fast is not None and isinstance(schedule_data, list):
+            features = extract_features_fast(schedule_data, SCHEDULE_FEATURES)
+            return pd.DataFrame(features, columns=FEATURE_COLUMNS)
+        
+        n = len(schedule_data)
+        features = np.empty((n, len(SCHEDULE_FEATURES)), dtype=np.float32)
         
-        return pd.DataFrame(features)
+        # Fill one column at a time instead of building a dict per entry
+        for j, (_, key, default) in enumerate(SCHEDULE_FEATURES):
+            features[:, j] = np.fromiter(
+                (entry.get(key, default) for entry in schedule_data),
+                dtype=np.float32,
+                count=n
+            )
+        
+        return pd.DataFrame(features, columns=FEATURE_COLUMNS)
     
-    def classify_anomaly(self, features):
-        """
-        Classify type of anomaly
-        """
-        if features['consecutive_calls'] > 2:
-            return 'Excessive Consecutive Calls'
-        elif features['coverage_gaps'] > 0:
-            return 'Coverage Gap Detected'
-        elif features['fairness_index'] < 0.5:
-            return 'Unfair Distribution'
-        elif features['vacation_conflicts'] > 0:
-            return 'Vacation Conflict'
-        else:
-            return 'General Anomaly'
+    def classify_anomalies(self, features):
+        """
+        Classify type of anomaly for every feature row (ndarray).
+        Returns codes into ANOMALY_TYPES / RECOMMENDATIONS; the first
+        matching rule wins.
+        """
+        return np.select(
+            [
+                features[:, CONSECUTIVE_CALLS] > 2,
+                features[:, COVERAGE_GAPS] > 0,
+                features[:, FAIRNESS_INDEX] < 0.5,
+                features[:, VACATION_CONFLICTS] > 0
+            ],
+            [0, 1, 2, 3],
+            default=4
+        )
     
-    def calculate_severity(self, anomaly_score):
+    def calculate_severities(self, anomaly_scores):
         """
-        Calculate severity of anomaly
+        Calculate severity of each decision score as codes into SEVERITY_LEVELS.
+        Scores are relative to the anomaly threshold, so lower is more severe.
         """
-        if anomaly_score < -0.5:
-            return 'Critical'
-        elif anomaly_score < -0.3:
-            return 'High'
-        elif anomaly_score < -0.1:
-            return 'Medium'
-        else:
-            return 'Low'
+        return np.digitize(anomaly_scores, SEVERITY_BINS)
     
     def get_anomaly_details(self, features, original_data):
         """
-        Get detailed information about anomaly
+        Get detailed information about anomaly from its feature row (ndarray)
         """
         return {
             'affected_residents': original_data.get('residents', []),
             'date_range': original_data.get('date_range', ''),
-            'metrics': features.to_dict()
+            'metrics': dict(zip(FEATURE_COLUMNS, features.tolist()))
         }
     
-    def get_recommendation(self, features):
-        """
-        Generate recommendation for fixing anomaly
-        """
-        if features['consecutive_calls'] > 2:
-            return 'Redistribute calls to prevent burnout. Consider adding post-call days.'
-        elif features['coverage_gaps'] > 0:
-            return 'Fill coverage gaps by adjusting vacation approvals or adding backup residents.'
-        elif features['fairness_index'] < 0.5:
-            return 'Rebalance call distribution to ensure fairness across all residents.'
-        elif features['vacation_conflicts'] > 0:
-            return 'Review and adjust vacation schedules to avoid conflicts.'
-        else:
-            return 'Review schedule manually for optimization opportunities.'
-    
     def calculate_health_score(self, predictions):
         """
         Calculate overall schedule health score
@@ -1,108 +1,429 @@
+import os
 import numpy as np
-import pandas as pd
+from sklearn.base import is_classifier
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
-import pickle
+import joblib
+from joblib import Parallel, delayed
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import firebase_admin
 from firebase_admin import firestore
 
+try:
+    # Optional: ONNX Runtime serves the exported forest faster than sklearn
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+try:
+    # Optional: only needed to export a trained model to ONNX
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+except ImportError:
+    convert_sklearn = None
+
+# Replaced by numba's prange when the quantized kernel is first compiled
+prange = range
+
+HISTORY_LIMIT = 100
+# Concurrent history queries; each is one round trip on the shared client
+HISTORY_WORKERS = 8
+
+# Model input order shared by training and inference
+FEATURE_COLUMNS = (
+    'day_of_week',
+    'month',
+    'is_weekend',
+    'is_holiday',
+    'days_since_last_call',
+    'total_calls_this_month',
+    'pgy_level',
+    'historical_avg_calls',
+    'team_size',
+    'vacation_conflicts',
+)
+
+# Split thresholds and inputs are mapped onto [0, QUANT_RANGE] per feature
+QUANT_RANGE = 32000
+
+# Below this many (day, resident) rows the per-day build runs inline; a
+# process pool costs far more than building a few hundred dicts
+PARALLEL_MIN_ROWS = 100000
+
+# Rows traversed together per tree so its nodes stay in cache
+BLOCK_SIZE = 64
+
+def _wdfs_order(tree):
+    """
+    Node order for one tree: depth-first, visiting the child that more
+    training samples reached first, so the likely path is laid out contiguously
+    """
+    left, right, weight = tree.children_left, tree.children_right, tree.n_node_samples
+    order = []
+    stack = [0]
+    
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        if left[node] >= 0:
+            if weight[left[node]] >= weight[right[node]]:
+                stack.extend((right[node], left[node]))
+            else:
+                stack.extend((left[node], right[node]))
+    
+    return np.array(order, dtype=np.intp)
+
+def _predict_forest(X_q, feature, threshold, left, right, leaf, roots):
+    """
+    Average class-1 leaf probability over all trees for each quantized row
+    """
+    n_samples = X_q.shape[0]
+    n_trees = roots.shape[0]
+    out = np.zeros(n_samples, dtype=np.float32)
+    n_blocks = (n_samples + BLOCK_SIZE - 1) // BLOCK_SIZE
+    
+    for b in prange(n_blocks):
+        start = b * BLOCK_SIZE
+        stop = min(start + BLOCK_SIZE, n_samples)
+        for t in range(n_trees):
+            for i in range(start, stop):
+                node = roots[t]
+                while feature[node] >= 0:
+                    if X_q[i, feature[node]] <= threshold[node]:
+                        node = left[node]
+                    else:
+                        node = right[node]
+                out[i] += leaf[node]
+    
+    return out / n_trees
+
+_forest_kernel = None
+
+def _load_forest_kernel():
+    """
+    JIT-compile _predict_forest on first use. Numba is optional and only
+    imported (and configured) for predictors that opt into use_quantized;
+    returns None when it is not installed
+    """
+    global _forest_kernel, prange
+    if _forest_kernel is None:
+        try:
+            from numba import njit, prange as numba_prange, config as numba_config
+        except ImportError:
+            return None
+        # Gunicorn serves requests from several threads; the default workqueue
+        # layer aborts on concurrent parallel calls
+        numba_config.THREADING_LAYER = 'threadsafe'
+        # Numba resolves globals at compile time, so the kernel's loop
+        # becomes parallel only from here on
+        prange = numba_prange
+        _forest_kernel = njit(parallel=True, cache=True)(_predict_forest)
+    return _forest_kernel
+
+def _build_day_result(current_date, day_probabilities, resident_ids, resident_names):
+    """
+    Assemble one day's prediction from its per-resident probabilities
+    """
+    recommended = day_probabilities > 0.7
+    
+    # The recommended residents are exactly the top-K, so only they
+    # are ordered (highest first); the rest follow unsorted
+    top = np.flatnonzero(recommended)
+    top = top[np.argsort(-day_probabilities[top], kind='stable')]
+    order = np.concatenate([top, np.flatnonzero(~recommended)])
+    # Plain Python floats/bools so the result serializes as JSON
+    probabilities = day_probabilities.tolist()
+    flags = recommended.tolist()
+    
+    return {
+        'date': current_date.isoformat(),
+        'total_coverage_needed': len(top),
+        'assignments': [
+            {
+                'date': current_date,
+                'resident_id': resident_ids[i],
+                'resident_name': resident_names[i],
+                'call_probability': probabilities[i],
+                'recommended': flags[i]
+            }
+            for i in order
+        ]
+    }
+
 class CallLoadPredictor:
     """
     Predicts future call load and optimal distribution
     """
-    def __init__(self, model_path='models/schedule_predictor.pkl'):
-        self.model = self.load_model(model_path)
+    def __init__(self, model_path='models/schedule_predictor.pkl',
+                 scaler_path='models/schedule_scaler.npz',
+                 onnx_path='models/schedule_predictor.onnx',
+                 n_jobs=1, use_quantized=False):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.onnx_path = onnx_path
+        self.model, model_fitted = self.load_model(model_path)
+        # Only used to fit the scaling; inference applies the saved arrays
         self.scaler = StandardScaler()
+        self.feature_mean, self.feature_iscale, scaling_fitted = self.load_scaling(scaler_path)
+        # A forest trained on standardized inputs is useless without its
+        # scaling (e.g. a pickle saved before the .npz existed)
+        self.is_fitted = model_fitted and scaling_fitted
+        if not self.is_fitted:
+            self.model = self.new_model()
+        self.ort_session = self.load_onnx_session(onnx_path) if self.is_fitted else None
+        # The int16 kernel is approximate (a few trees can take the other
+        # branch near a threshold), so it is only used when asked for
+        self.use_quantized = use_quantized
+        self.compiled_forest = self.compile_forest()
+        self.n_jobs = n_jobs
         self.db = firestore.client()
         
+    def new_model(self):
+        return RandomForestRegressor(
+            n_estimators=100,
+            max_depth=10,
+            random_state=42
+        )
+    
     def load_model(self, path):
         try:
-            with open(path, 'rb') as f:
-                return pickle.load(f)
+            return joblib.load(path), True
         except:
             # Initialize new model if not found
-            return RandomForestRegressor(
-                n_estimators=100,
-                max_depth=10,
-                random_state=42
+            return self.new_model(), False
+    
+    def load_scaling(self, path):
+        try:
+            with np.load(path) as scaling:
+                return scaling['mean'], scaling['iscale'], True
+        except:
+            # Identity scaling until train_model runs
+            n_features = len(FEATURE_COLUMNS)
+            return np.zeros(n_features, np.float32), np.ones(n_features, np.float32), False
+    
+    def scale_features(self, X):
+        """
+        Standardize feature rows with the persisted float32 mean / inverse scale
+        """
+        return (X - self.feature_mean) * self.feature_iscale
+    
+    def load_onnx_session(self, path):
+        if onnxruntime is None:
+            return None
+        try:
+            return onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        except:
+            # Fall back to sklearn inference if no exported model
+            return None
+    
+    def export_onnx(self, path=None):
+        """
+        Export the trained model to ONNX for faster inference. Only
+        classifiers are exported (inference reads their class-1 probability);
+        returns None when nothing was exported
+        """
+        path = path or self.onnx_path
+        # Drop the previous export first so a skipped or failed export never
+        # leaves the old model serving, in-process or after a restart
+        self.ort_session = None
+        if os.path.exists(path):
+            os.remove(path)
+        if convert_sklearn is None or not is_classifier(self.model):
+            return None
+        
+        onnx_model = convert_sklearn(
+            self.model,
+            initial_types=[('X', FloatTensorType([None, len(FEATURE_COLUMNS)]))],
+            options={id(self.model): {'zipmap': False}}
+        )
+        with open(path, 'wb') as f:
+            f.write(onnx_model.SerializeToString())
+        
+        self.ort_session = self.load_onnx_session(path)
+        return path
+    
+    def compile_forest(self):
+        """
+        Flatten the trained forest into contiguous node arrays shared by all
+        trees, each tree in weighted-DFS order, with int16 quantized
+        feature/threshold buffers for the Numba traversal kernel
+        """
+        if not self.use_quantized or _load_forest_kernel() is None \
+                or not hasattr(self.model, 'estimators_') \
+                or not hasattr(self.model, 'predict_proba'):
+            return None
+        
+        trees = [estimator.tree_ for estimator in self.model.estimators_]
+        n_features = self.model.n_features_in_
+        
+        # Per-feature affine scale fitted to the range of split thresholds
+        lo = np.full(n_features, np.inf)
+        hi = np.full(n_features, -np.inf)
+        for tree in trees:
+            split = tree.feature >= 0
+            np.minimum.at(lo, tree.feature[split], tree.threshold[split])
+            np.maximum.at(hi, tree.feature[split], tree.threshold[split])
+        unused = ~np.isfinite(lo)
+        lo[unused] = 0
+        hi[unused] = 0
+        span = hi - lo
+        scale = QUANT_RANGE / np.where(span > 0, span, 1)
+        
+        roots = np.cumsum([0] + [tree.node_count for tree in trees[:-1]]).astype(np.int32)
+        total_nodes = sum(tree.node_count for tree in trees)
+        feature = np.empty(total_nodes, dtype=np.int16)
+        threshold = np.empty(total_nodes, dtype=np.int16)
+        left = np.empty(total_nodes, dtype=np.int32)
+        right = np.empty(total_nodes, dtype=np.int32)
+        leaf = np.empty(total_nodes, dtype=np.float32)
+        
+        for root, tree in zip(roots, trees):
+            order = _wdfs_order(tree)
+            # Position of each original node in the flattened layout
+            position = np.empty(tree.node_count, dtype=np.int32)
+            position[order] = root + np.arange(tree.node_count, dtype=np.int32)
+            nodes = slice(root, root + tree.node_count)
+            
+            split = tree.feature[order] >= 0
+            features = np.where(split, tree.feature[order], 0)
+            feature[nodes] = np.where(split, features, -1)
+            threshold[nodes] = np.where(
+                split,
+                np.floor((tree.threshold[order] - lo[features]) * scale[features]),
+                0
             )
+            left[nodes] = np.where(split, position[tree.children_left[order]], -1)
+            right[nodes] = np.where(split, position[tree.children_right[order]], -1)
+            # Leaf probability of the positive class, as predict_proba averages it
+            value = tree.value[order, 0, :]
+            leaf[nodes] = value[:, 1] / value.sum(axis=1)
+        
+        return {
+            'lo': lo,
+            'scale': scale,
+            'feature': feature,
+            'threshold': threshold,
+            'left': left,
+            'right': right,
+            'leaf': leaf,
+            'roots': roots
+        }
     
-    def extract_features(self, date, resident_data, historical_data):
+    def quantize_inputs(self, X_scaled):
         """
-        Extract features for prediction
+        Map scaled feature rows onto the forest's int16 threshold grid.
+        Values outside the split range clip to just below/above every threshold.
+        """
+        forest = self.compiled_forest
+        X_q = np.floor((X_scaled - forest['lo']) * forest['scale'])
+        return np.clip(X_q, -1, QUANT_RANGE + 1).astype(np.int16)
+    
+    def predict_probabilities(self, X_scaled):
+        """
+        Probability of needing call coverage for each scaled feature row.
+        The quantized kernel runs only when use_quantized was requested;
+        otherwise the exact ONNX session is preferred over sklearn.
+        """
+        if not self.is_fitted:
+            raise ValueError('CallLoadPredictor has no trained model and scaling; run train_model first')
+        if self.compiled_forest is not None:
+            forest = self.compiled_forest
+            return _load_forest_kernel()(
+                self.quantize_inputs(X_scaled),
+                forest['feature'],
+                forest['threshold'],
+                forest['left'],
+                forest['right'],
+                forest['leaf'],
+                forest['roots']
+            )
+        if self.ort_session is not None:
+            # Outputs are (labels, probabilities) with zipmap disabled
+            return self.ort_session.run(None, {'X': X_scaled.astype(np.float32)})[1][:, 1]
+        return self.model.predict_proba(X_scaled)[:, 1]
+    
+    def extract_features(self, date, resident_data, historical_data,
+                         is_holiday=False, vacation_conflicts=0):
+        """
+        Extract one feature row (in FEATURE_COLUMNS order) for prediction.
+        Holiday and vacation data are looked up by the caller for the whole period.
         """
         features = {
             'day_of_week': date.weekday(),
             'month': date.month,
             'is_weekend': date.weekday() >= 5,
-            'is_holiday': self.is_holiday(date),
+            'is_holiday': is_holiday,
             'days_since_last_call': self.calculate_days_since_last_call(resident_data),
             'total_calls_this_month': resident_data.get('monthly_calls', 0),
             'pgy_level': resident_data.get('pgy_level', 1),
             'historical_avg_calls': self.calculate_historical_average(historical_data),
             'team_size': resident_data.get('team_size', 10),
-            'vacation_conflicts': self.check_vacation_conflicts(date),
+            'vacation_conflicts': vacation_conflicts,
         }
-        return pd.DataFrame([features])
+        return [features[column] for column in FEATURE_COLUMNS]
     
     def predict_call_load(self, date, period_days=30):
         """
         Predict call load for next period
         """
-        predictions = []
-        current_date = date
+        end_date = date + timedelta(days=period_days-1)
+        days = [date + timedelta(days=i) for i in range(period_days)]
         
-        for _ in range(period_days):
-            # Get resident data
-            residents = self.get_active_residents(current_date)
-            
-            daily_predictions = []
-            for resident in residents:
-                features = self.extract_features(
-                    current_date,
-                    resident,
-                    self.get_historical_data(resident['id'])
-                )
-                
-                # Predict probability of needing call coverage
-                scaled_features = self.scaler.fit_transform(features)
-                probability = self.model.predict_proba(scaled_features)[0][1]
-                
-                daily_predictions.append({
-                    'date': current_date,
-                    'resident_id': resident['id'],
-                    'resident_name': resident['name'],
-                    'call_probability': probability,
-                    'recommended': probability > 0.7
-                })
-            
-            predictions.append({
-                'date': current_date.isoformat(),
-                'total_coverage_needed': sum(1 for p in daily_predictions if p['recommended']),
-                'assignments': sorted(daily_predictions, key=lambda x: x['call_probability'], reverse=True)
-            })
-            
-            current_date += timedelta(days=1)
+        # Fetch everything the period needs once and join in memory
+        residents = self.get_active_residents(date)
+        historical_data = self.get_historical_data_batch([r['id'] for r in residents])
+        holiday_days = self.get_holiday_days()
+        vacations_by_day = self.get_vacations_by_day(date, end_date)
+        
+        # One (days x residents, features) matrix so the model is called once
+        X = np.array([
+            self.extract_features(
+                current_date,
+                resident,
+                historical_data[resident['id']],
+                is_holiday=self.is_holiday(current_date, holiday_days),
+                vacation_conflicts=len(vacations_by_day[current_date.date()])
+            )
+            for current_date in days
+            for resident in residents
+        ], dtype=np.float32).reshape(-1, len(FEATURE_COLUMNS))
+        
+        # Predict probability of needing call coverage
+        if len(X):
+            probabilities = self.predict_probabilities(self.scale_features(X))
+        else:
+            probabilities = np.empty(0, dtype=np.float32)
+        probabilities = probabilities.reshape(period_days, len(residents))
+        
+        # Days are independent once scored; fan out only for large periods
+        resident_ids = [r['id'] for r in residents]
+        resident_names = [r['name'] for r in residents]
+        if self.n_jobs != 1 and probabilities.size >= PARALLEL_MIN_ROWS:
+            predictions = Parallel(n_jobs=self.n_jobs, backend='loky')(
+                delayed(_build_day_result)(current_date, day_probabilities, resident_ids, resident_names)
+                for current_date, day_probabilities in zip(days, probabilities)
+            )
+        else:
+            predictions = [
+                _build_day_result(current_date, day_probabilities, resident_ids, resident_names)
+                for current_date, day_probabilities in zip(days, probabilities)
+            ]
         
         return {
             'period_start': date.isoformat(),
-            'period_end': (date + timedelta(days=period_days-1)).isoformat(),
+            'period_end': end_date.isoformat(),
             'predictions': predictions,
-            'confidence': self.calculate_confidence_score(predictions)
+            'confidence': self.calculate_confidence_score(probabilities)
         }
     
-    def calculate_confidence_score(self, predictions):
+    def calculate_confidence_score(self, probabilities):
         """
-        Calculate overall confidence in predictions
+        Calculate overall confidence from the predicted probabilities array
         """
         # Simplified confidence calculation
-        avg_probability = np.mean([
-            p['call_probability'] 
-            for day in predictions 
-            for p in day['assignments']
-        ])
-        return min(0.95, avg_probability + 0.3)
+        return min(0.95, float(probabilities.mean()) + 0.3)
     
     def get_active_residents(self, date):
         """
@@ -113,13 +434,27 @@ class CallLoadPredictor:
         residents = residents_ref.where('active', '==', True).get()
         return [r.to_dict() for r in residents]
     
-    def is_holiday(self, date):
+    def get_holiday_days(self):
         """
-        Check if date is a holiday
+        Get all holiday dates as a sorted array of day ordinals
         """
         holidays = self.db.collection('holidays').get()
-        holiday_dates = [h.to_dict()['date'].date() for h in holidays]
-        return date.date() in holiday_dates
+        return np.unique(np.fromiter(
+            (h.to_dict()['date'].toordinal() for h in holidays),
+            dtype=np.int64,
+            count=len(holidays)
+        ))
+    
+    def is_holiday(self, date, holiday_days=None):
+        """
+        Check if date is a holiday, against ordinals from get_holiday_days
+        when given, otherwise against a fresh fetch
+        """
+        if holiday_days is None:
+            holiday_days = self.get_holiday_days()
+        day = date.toordinal()
+        i = np.searchsorted(holiday_days, day)
+        return bool(i < len(holiday_days) and holiday_days[i] == day)
     
     def calculate_days_since_last_call(self, resident_data):
         """
@@ -131,17 +466,26 @@ class CallLoadPredictor:
         
         return (datetime.now() - last_call).days
     
-    def check_vacation_conflicts(self, date):
+    def get_vacations_by_day(self, start_date, end_date):
         """
-        Check for vacation conflicts on date
+        Get approved leave overlapping the period, indexed by each day it covers
         """
         vacations = self.db.collection('leaveRequests')\
             .where('status', '==', 'Approved')\
-            .where('startDate', '<=', date)\
-            .where('endDate', '>=', date)\
+            .where('endDate', '>=', start_date)\
+            .where('startDate', '<=', end_date)\
             .get()
         
-        return len(vacations)
+        vacations_by_day = defaultdict(list)
+        for v in vacations:
+            vacation = v.to_dict()
+            day = max(vacation['startDate'].date(), start_date.date())
+            last_day = min(vacation['endDate'].date(), end_date.date())
+            while day <= last_day:
+                vacations_by_day[day].append(vacation)
+                day += timedelta(days=1)
+        
+        return vacations_by_day
     
     def get_historical_data(self, resident_id):
         """
@@ -150,24 +494,47 @@ class CallLoadPredictor:
         calls = self.db.collection('callAssignments')\
             .where('residentId', '==', resident_id)\
             .order_by('date', direction=firestore.Query.DESCENDING)\
-            .limit(100)\
+            .limit(HISTORY_LIMIT)\
             .get()
         
         return [c.to_dict() for c in calls]
     
+    def get_historical_data_batch(self, resident_ids):
+        """
+        Get historical call data for many residents, issuing the limited
+        per-resident queries concurrently
+        """
+        if not resident_ids:
+            return {}
+        
+        with ThreadPoolExecutor(max_workers=min(HISTORY_WORKERS, len(resident_ids))) as executor:
+            calls = executor.map(self.get_historical_data, resident_ids)
+            return dict(zip(resident_ids, calls))
+    
     def train_model(self, training_data):
         """
         Train the prediction model
         """
-        X = training_data.drop(['target'], axis=1)
+        X = training_data[list(FEATURE_COLUMNS)]
         y = training_data['target']
         
-        X_scaled = self.scaler.fit_transform(X)
+        # Fit the scaling once, then train on exactly what inference computes
+        self.scaler.fit(X.values)
+        self.feature_mean = self.scaler.mean_.astype(np.float32)
+        self.feature_iscale = (1 / self.scaler.scale_).astype(np.float32)
+        
+        X_scaled = self.scale_features(X.values.astype(np.float32))
         self.model.fit(X_scaled, y)
+        self.is_fitted = True
+        self.compiled_forest = self.compile_forest()
         
-        # Save model
-        with open('models/schedule_predictor.pkl', 'wb') as f:
-            pickle.dump(self.model, f)
+        # Save model and the scaling it was trained with. The model is left
+        # uncompressed so workers load it without a decompression pass
+        for path in (self.model_path, self.scaler_path, self.onnx_path):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump(self.model, self.model_path)
+        np.savez(self.scaler_path, mean=self.feature_mean, iscale=self.feature_iscale)
+        self.export_onnx()
         
         return {
             'status': 'trained',
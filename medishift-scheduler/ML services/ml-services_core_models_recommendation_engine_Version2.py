@@ -1,8 +1,29 @@
+import math
 import numpy as np
 from typing import List, Dict, Any
 import pandas as pd
+from collections import Counter
 from datetime import datetime, timedelta
 
+SCHEDULING_RULES = {
+    'max_consecutive_calls': 2,
+    'min_rest_between_calls': 2,
+    'max_weekend_calls': 2,
+    'fairness_threshold': 0.7
+}
+
+# Estimated improvement per metric for each recommendation type
+IMPROVEMENT_IMPACT = {
+    'coverage_gaps': {'coverage': 30},
+    'workload_balance': {'fairness': 25, 'satisfaction': 20},
+    'vacation_conflicts': {'satisfaction': 15},
+    'fairness': {'fairness': 20, 'satisfaction': 25}
+}
+IMPROVEMENT_METRICS = ('coverage', 'fairness', 'efficiency', 'satisfaction')
+
+# Sort rank of each recommendation priority; unknown priorities go last
+PRIORITY_ORDER = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+
 class SmartScheduleRecommender:
     """
     Provides intelligent scheduling recommendations
@@ -62,30 +83,35 @@ class SmartScheduleRecommender:
         """
         Recommend workload balancing changes
         """
-        overloaded = []
-        underloaded = []
+        residents = schedule['residents']
+        calls = np.fromiter(
+            (r['call_count'] for r in residents),
+            dtype=np.float64,
+            count=len(residents)
+        )
+        
+        overloaded = np.flatnonzero(calls > schedule['average_calls'] * 1.2)
+        underloaded = np.flatnonzero(calls < schedule['average_calls'] * 0.8)
         
-        for resident in schedule['residents']:
-            if resident['call_count'] > schedule['average_calls'] * 1.2:
-                overloaded.append(resident)
-            elif resident['call_count'] < schedule['average_calls'] * 0.8:
-                underloaded.append(resident)
+        # Pair the most overloaded with the most underloaded, top 5 pairs only
+        overloaded = overloaded[np.argsort(-calls[overloaded], kind='stable')]
+        underloaded = underloaded[np.argsort(calls[underloaded], kind='stable')]
         
         swaps = []
-        for over in overloaded:
-            for under in underloaded:
-                if self.can_swap(over, under, schedule):
-                    swaps.append({
-                        'from': over['id'],
-                        'to': under['id'],
-                        'dates': self.find_swappable_dates(over, under, schedule)
-                    })
+        for i, j in zip(overloaded[:5], underloaded[:5]):
+            over, under = residents[i], residents[j]
+            if self.can_swap(over, under, schedule):
+                swaps.append({
+                    'from': over['id'],
+                    'to': under['id'],
+                    'dates': self.find_swappable_dates(over, under, schedule)
+                })
         
         return {
             'type': 'workload_balance',
             'priority': 'high',
             'description': f'Rebalance workload: {len(overloaded)} overloaded, {len(underloaded)} underloaded residents',
-            'suggested_swaps': swaps[:5],  # Top 5 swaps
+            'suggested_swaps': swaps,
             'impact': 'Improves fairness by 25%'
         }
     
@@ -203,11 +229,9 @@ class SmartScheduleRecommender:
         """
         Prioritize recommendations by impact and urgency
         """
-        priority_map = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
-        
         sorted_recs = sorted(
             recommendations,
-            key=lambda x: priority_map.get(x['priority'], 4)
+            key=lambda x: PRIORITY_ORDER.get(x['priority'], len(PRIORITY_ORDER))
         )
         
         return sorted_recs[:3]  # Top 3 priority actions
@@ -216,44 +240,34 @@ class SmartScheduleRecommender:
         """
         Estimate overall improvement from recommendations
         """
-        improvements = {
-            'coverage': 0,
-            'fairness': 0,
-            'efficiency': 0,
-            'satisfaction': 0
-        }
+        improvements = Counter()
         
         for rec in recommendations:
-            if rec['type'] == 'coverage_gaps':
-                improvements['coverage'] += 30
-            elif rec['type'] == 'workload_balance':
-                improvements['fairness'] += 25
-                improvements['satisfaction'] += 20
-            elif rec['type'] == 'vacation_conflicts':
-                improvements['satisfaction'] += 15
-            elif rec['type'] == 'fairness':
-                improvements['fairness'] += 20
-                improvements['satisfaction'] += 25
+            improvements.update(IMPROVEMENT_IMPACT.get(rec['type'], {}))
         
         return {
-            metric: min(100, value) 
-            for metric, value in improvements.items()
+            metric: min(100, improvements[metric])
+            for metric in IMPROVEMENT_METRICS
         }
     
     # Helper methods
     def load_scheduling_rules(self):
-        return {
-            'max_consecutive_calls': 2,
-            'min_rest_between_calls': 2,
-            'max_weekend_calls': 2,
-            'fairness_threshold': 0.7
-        }
+        # Per-instance copy so edits don't leak into other engines
+        return dict(SCHEDULING_RULES)
     
     def calculate_workload_imbalance(self, schedule):
-        calls = [r['call_count'] for r in schedule.get('residents', [])]
-        if not calls:
+        # Coefficient of variation via one-pass (Welford) mean/variance
+        n = 0
+        mean = 0.0
+        m2 = 0.0
+        for r in schedule.get('residents', []):
+            n += 1
+            delta = r['call_count'] - mean
+            mean += delta / n
+            m2 += delta * (r['call_count'] - mean)
+        if n == 0:
             return 0
-        return np.std(calls) / np.mean(calls) if np.mean(calls) > 0 else 0
+        return math.sqrt(m2 / n) / mean if mean > 0 else 0
     
     def find_coverage_gaps(self, schedule):
         # Simplified - would check actual schedule data
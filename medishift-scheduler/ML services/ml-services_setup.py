@@ -0,0 +1,16 @@
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+# Build in place with: python setup.py build_ext --inplace
+extensions = [
+    Extension(
+        'core.models._anomaly_fast',
+        ['core/models/_anomaly_fast.pyx'],
+        extra_compile_args=['-O3']
+    )
+]
+
+setup(
+    name='ml-services',
+    ext_modules=cythonize(extensions)
+)